@@ -5,6 +5,10 @@ Depenencies:
     paho-mqtt (https://pypi.org/project/paho-mqtt/)
     sense-hat (https://pypi.org/project/sense-hat/)
     sdnotify (https://pypi.org/project/sdnotify/)
+    numpy (https://pypi.org/project/numpy/)
+    orjson (https://pypi.org/project/orjson/) - optional, faster JSON parsing
+    msgpack (https://pypi.org/project/msgpack/) - optional, binary payload support
+    numba (https://pypi.org/project/numba/) - optional, JIT-compiled frame building
 
 Update a SenseHAT LED Matrix with values from a Fronius inverter and Sungrow Battery
 obtained from MQTT.
@@ -21,11 +25,32 @@ Column 7: Sungrow Battery Level (light blue)
 Author: Ben Johns (bjohns@naturalnetworks.net)
 """
 
+import os
+import sys
 import time
-import json
+import types
+import queue
 import threading
+import numpy as np
 import paho.mqtt.client as mqtt
 
+try:
+    # orjson parses bytes natively, no intermediate str needed
+    from orjson import loads as _json_loads
+except ImportError:
+    # Reuse a single JSONDecoder instead of letting json.loads set one up
+    # per call, and decode the payload as ASCII (the telemetry always is)
+    # which is cheaper than UTF-8 for short strings
+    import json
+    _json_decode = json.JSONDecoder().decode
+    def _json_loads(payload):
+        return _json_decode(payload.decode('ascii'))
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 import sdnotify
 
 # Initialize sdnotify
@@ -33,23 +58,16 @@ notifier = sdnotify.SystemdNotifier()
 
 try:
     from sense_hat import SenseHat
+    sense = SenseHat()
 except ImportError:
     print("SenseHAT library not found. Mocking SenseHat functionality.")
-    # Define a mock SenseHat class to avoid errors
-    class SenseHat:
-        def __init__(self):
-            pass
-
-        def clear(self):
-            pass
+    # No-op stand-in; plain functions avoid per-call method dispatch
+    sense = types.SimpleNamespace(
+        clear=lambda: None,
+        set_pixel=lambda *args: None,
+        set_pixels=lambda *args: None,
+    )
 
-        def set_pixel(self, x, y, rgb):
-            pass
-
-        def low_light(self):
-            pass
-
-sense = SenseHat()
 sense.clear()
 sense.low_light = True
 
@@ -66,98 +84,229 @@ lightpurple = (196, 64, 196)
 orange = (255, 165, 0)
 yellow = (255, 255, 0)
 
-# Define MQTT topics and broker
+# Define MQTT topics and broker. Publishers migrating to msgpack use the
+# same topic with a "/msgpack" suffix so both codecs work during rollout.
 fronius_topic = "home/fronius"
 sungrow_topic = "home/sungrow"
+msgpack_suffix = "/msgpack"
 device_id = "rpizero.home.arpa"
 broker_address = "nas.home.arpa"
 broker_port = 1883
 
+# Print the CLI matrix only when debugging (set ENERGY_MONITOR_DEBUG=1)
+DEBUG_CLI = os.environ.get("ENERGY_MONITOR_DEBUG") == "1"
+
 # Define a function to print the LED matrix grid
 def print_cli_matrix(matrix):
-    print('1 2 3 4 5 6 7 8')
-    for row in matrix:
-        print(' '.join(row))
-    print('')
-
-# Initialize a 8x8 grid to represent the LED matrix
-cli_matrix = [['X' for _ in range(8)] for _ in range(8)]
-
-# Initialize variables to store cumulative values for Fronius and Sungrow data
-cumulative_fronius_values = {
-    'f_pvimport': 0,
-    'f_pvexport': 0,
-    'f_pvload': 0,
-    'f_pvgeneration': 0
-}
+    # Build the whole grid as one string and write it in a single call
+    sys.stdout.write('1 2 3 4 5 6 7 8\n' + '\n'.join(' '.join(row) for row in matrix) + '\n\n')
+
+# Initialize a 8x8 grid to represent the LED matrix, preallocated once
+cli_matrix = np.full((8, 8), 'X', dtype='U1')
+
+# Remember the last rendered LED counts so unchanged frames can be skipped
+_last_led_state = None
+
+# Off pixel colour and the last framebuffer pushed to the SenseHAT
+black = (0, 0, 0)
+_framebuffer = [list(black)] * 64
+
+# Per-column RGB palettes for the frame kernel. Column order: Fronius PV
+# export, Sungrow export, Fronius PV import, Sungrow purchased power,
+# Fronius PV load, Fronius PV generation, battery rate, battery level.
+# The two variants differ only in column 6 (charging vs discharging).
+_col_rgb_charging = np.array(
+    [lightgreen, green, lightred, red, orange, yellow, lightpurple, darkblue],
+    dtype=np.uint8)
+_col_rgb_discharging = _col_rgb_charging.copy()
+_col_rgb_discharging[6] = purple
+
+# Matching CLI characters per column
+_COL_CHARS_CHARGING = ('g', 'G', 'r', 'R', 'O', 'Y', 'p', 'B')
+_COL_CHARS_DISCHARGING = ('g', 'G', 'r', 'R', 'O', 'Y', 'P', 'B')
+
+# Preallocated buffers for the frame kernel
+_counts = np.zeros(8, dtype=np.int64)
+_out = np.zeros((64, 3), dtype=np.uint8)
+
+# Frame kernel: fill a 64 x RGB buffer from per-column LED counts and
+# colours. Compiled to native code when numba is available.
+def build_frame(counts, colors, out):
+    out[:] = 0
+    for col in range(8):
+        for row in range(counts[col]):
+            idx = row * 8 + col
+            out[idx, 0] = colors[col, 0]
+            out[idx, 1] = colors[col, 1]
+            out[idx, 2] = colors[col, 2]
 
-cumulative_sungrow_values = {
-    'sg_purchased_power': 0,
-    'sg_total_export_active__power': 0,
-    'sg_battery_charging_power': 0,
-    'sg_battery_discharging_power': 0,
-    'sg_battery_level_soc': 0
-}
+try:
+    from numba import njit
+    build_frame = njit(cache=True)(build_frame)
+except ImportError:
+    pass
+
+# Indices into the cumulative state vector
+IDX_F_PVIMPORT = 0
+IDX_F_PVEXPORT = 1
+IDX_F_PVLOAD = 2
+IDX_F_PVGENERATION = 3
+IDX_SG_PURCHASED_POWER = 4
+IDX_SG_TOTAL_EXPORT_ACTIVE_POWER = 5
+IDX_SG_BATTERY_CHARGING_POWER = 6
+IDX_SG_BATTERY_DISCHARGING_POWER = 7
+IDX_SG_BATTERY_LEVEL_SOC = 8
+
+# Cumulative Fronius and Sungrow values as one fixed-index numeric vector.
+# Writes from the MQTT thread and reads from the render worker both hold
+# _state_lock; the worker only copies the vector, never renders under it.
+state = np.zeros(9, dtype=np.float32)
+_state_lock = threading.Lock()
+
+# Per-index scaling to watts: Fronius values are already watts, Sungrow
+# powers arrive in kilowatts, and battery SoC (0 - 100 %) scales by 50 so
+# the whole vector shares the 625 W-per-LED divisor (100 % -> 8 LEDs)
+_led_scale = np.array([1, 1, 1, 1, 1000, 1000, 1000, 1000, 50], dtype=np.float32)
 
 # Define callback function for MQTT connection
 def on_connect(client, userdata, flags, reason_code, properties):
     print(f"Connected with result code {reason_code}")
-    client.subscribe(fronius_topic)
-    client.subscribe(sungrow_topic)
+    topics = [(fronius_topic, 0), (sungrow_topic, 0)]
+    if msgpack is not None:
+        topics += [(fronius_topic + msgpack_suffix, 0), (sungrow_topic + msgpack_suffix, 0)]
+    client.subscribe(topics)
 
 # Define callback function for MQTT message reception
 def on_message(client, userdata, msg):
-    payload = json.loads(msg.payload)
-    if msg.topic == fronius_topic:
-        update_cumulative_fronius_values(payload)
-    elif msg.topic == sungrow_topic:
-        update_cumulative_sungrow_values(payload)
-    update_senseHatLED(**cumulative_fronius_values, **cumulative_sungrow_values)
+    # msgpack-suffixed topics carry binary payloads; plain topics stay JSON
+    topic = msg.topic
+    if topic.endswith(msgpack_suffix):
+        payload = msgpack.unpackb(msg.payload, raw=False)
+        topic = topic[:-len(msgpack_suffix)]
+    else:
+        payload = _json_loads(msg.payload)
+    handler = _HANDLERS.get(topic)
+    if handler is None:
+        return
+    # Only redraw when the payload actually changed a tracked value
+    if handler(payload):
+        _dirty.set()
+
+# Mapping of state vector indices to their MQTT payload keys
+_FRONIUS_KEYS = (
+    (IDX_F_PVIMPORT, 'pvImport'),
+    (IDX_F_PVEXPORT, 'pvExport'),
+    (IDX_F_PVLOAD, 'pvLoad'),
+    (IDX_F_PVGENERATION, 'pvGeneration'),
+)
+
+_SUNGROW_KEYS = (
+    (IDX_SG_PURCHASED_POWER, 'Purchased_Power'),
+    (IDX_SG_TOTAL_EXPORT_ACTIVE_POWER, 'Total_Export_Active__Power'),
+    (IDX_SG_BATTERY_CHARGING_POWER, 'Battery_Charging_Power'),
+    (IDX_SG_BATTERY_DISCHARGING_POWER, 'Battery_Discharging_Power'),
+    (IDX_SG_BATTERY_LEVEL_SOC, 'Battery_Level_SOC'),
+)
 
 # Function to update cumulative values for Fronius data
-def update_cumulative_fronius_values(payload):
-    # Update cumulative values with new data from payload
-    cumulative_fronius_values['f_pvimport'] = payload.get("pvImport", cumulative_fronius_values['f_pvimport'])
-    cumulative_fronius_values['f_pvexport'] = payload.get("pvExport", cumulative_fronius_values['f_pvexport'])
-    cumulative_fronius_values['f_pvload'] = payload.get("pvLoad", cumulative_fronius_values['f_pvload'])
-    cumulative_fronius_values['f_pvgeneration'] = payload.get("pvGeneration", cumulative_fronius_values['f_pvgeneration'])
+def update_cumulative_fronius_values(payload, _state=state, _keys=_FRONIUS_KEYS):
+    # Bind the lookups as locals; this runs for every incoming message
+    get = payload.get
+    changed = False
+    with _state_lock:
+        for index, external in _keys:
+            old_value = _state[index]
+            new_value = get(external, old_value)
+            if new_value != old_value:
+                _state[index] = new_value
+                changed = True
+    return changed
 
 # Function to update cumulative values for Sungrow data
-def update_cumulative_sungrow_values(payload):
-    # Update cumulative values with new data from payload
-    cumulative_sungrow_values['sg_purchased_power'] = payload.get("Purchased_Power", cumulative_sungrow_values['sg_purchased_power'])
-    cumulative_sungrow_values['sg_total_export_active__power'] = payload.get("Total_Export_Active__Power", cumulative_sungrow_values['sg_total_export_active__power'])
-    cumulative_sungrow_values['sg_battery_charging_power'] = payload.get("Battery_Charging_Power", cumulative_sungrow_values['sg_battery_charging_power'])
-    cumulative_sungrow_values['sg_battery_discharging_power'] = payload.get("Battery_Discharging_Power", cumulative_sungrow_values['sg_battery_discharging_power'])
-    cumulative_sungrow_values['sg_battery_level_soc'] = payload.get("Battery_Level_SOC", cumulative_sungrow_values['sg_battery_level_soc'])
+def update_cumulative_sungrow_values(payload, _state=state, _keys=_SUNGROW_KEYS):
+    # Bind the lookups as locals; this runs for every incoming message
+    get = payload.get
+    changed = False
+    with _state_lock:
+        for index, external in _keys:
+            old_value = _state[index]
+            new_value = get(external, old_value)
+            if new_value != old_value:
+                _state[index] = new_value
+                changed = True
+    return changed
+
+# Topic dispatch table for on_message
+_HANDLERS = {
+    fronius_topic: update_cumulative_fronius_values,
+    sungrow_topic: update_cumulative_sungrow_values,
+}
+
+# Event used to coalesce bursts of MQTT updates into a single redraw
+_dirty = threading.Event()
+
+# Most recent frame awaiting transfer to the SenseHAT; size one so a
+# newer frame simply replaces an unsent older one
+_frame_queue = queue.Queue(maxsize=1)
+
+# Hand a frame to the LED worker, dropping any unsent older frame
+def _queue_frame(frame):
+    try:
+        _frame_queue.put_nowait(frame)
+    except queue.Full:
+        try:
+            _frame_queue.get_nowait()
+        except queue.Empty:
+            pass
+        _frame_queue.put_nowait(frame)
+
+# Worker loop that pushes queued frames over I2C to the SenseHAT, keeping
+# the slow transfer off the threads that ingest MQTT and build frames
+def led_worker():
+    while True:
+        frame = _frame_queue.get()
+        sense.set_pixels(frame)
+
+# Worker loop that redraws the LED matrix when new data has arrived
+def render_worker():
+    while True:
+        _dirty.wait()
+        _dirty.clear()
+        # Short coalescing window so near-simultaneous Fronius and
+        # Sungrow updates render as a single frame
+        time.sleep(0.05)
+        # Snapshot the state vector under the lock (a 36-byte memcpy) and
+        # render from the copy so the lock is never held during I/O
+        with _state_lock:
+            snapshot = state.copy()
+        update_senseHatLED(snapshot)
+
+# Precomputed battery animation frames, one per LED bar height, so each
+# animation step is a single set_pixels blit instead of a clear plus up
+# to eight set_pixel round-trips
+_BATTERY_FRAMES = []
+for _pixel_y in range(8):
+    _frame = [black] * 64
+    for _i in range(_pixel_y + 1):
+        _frame[(7 - _i) * 8 + 7] = blue
+    _BATTERY_FRAMES.append(_frame)
 
 # Function to animate battery charging or discharging
 def animate_battery(charge_rate=0, discharge_rate=0, current_soc=0, charging_speed=0.1, discharge_speed=0.1):
     # Calculate the target state of charge based on charge and discharge rates
     target_soc = current_soc + charge_rate - discharge_rate
-    
+
     # Determine direction of animation
     direction = 1 if charge_rate > discharge_rate else -1
-    
+
     # Start animation loop
     for soc in range(current_soc, target_soc + direction, direction):
-        # Clear only the current column
-        sense.clear()
-        
         # Calculate LED position based on SoC
-        pixel_y = int((soc / 8) * 7)  # Convert SoC to LED row
-        
-        # Draw LED bar
-        for i in range(pixel_y + 1):
-            sense.set_pixel(7, 7 - i, blue)
-            cli_matrix[7][7 - i] = 'B'
-
-        # Draw LED bar
-        #for i in range(8):
-        #    sense.set_pixel(7, 7 - i, blue)
-        #    cli_matrix[7][7 - i] = 'b'
-            
-        
+        pixel_y = min(int((soc / 8) * 7), 7)  # Convert SoC to LED row
+
+        # Blit the whole precomputed frame in one transfer
+        sense.set_pixels(_BATTERY_FRAMES[pixel_y])
+
         # Display LED matrix
         if direction == 1:
             time.sleep(charging_speed)
@@ -167,137 +316,77 @@ def animate_battery(charge_rate=0, discharge_rate=0, current_soc=0, charging_spe
 
 
 # Function to update SenseHat LED Matrix with energy data
-def update_senseHatLED(
-    f_pvimport,
-    f_pvexport,
-    f_pvload,
-    f_pvgeneration,
-    sg_purchased_power,
-    sg_total_export_active__power,
-    sg_battery_charging_power,
-    sg_battery_discharging_power,
-    sg_battery_level_soc
-    ):
-
-    # Convert Sungrow energy values from kilowatts to watts
-    sg_purchased_power *= 1000
-    sg_total_export_active__power *= 1000
-    sg_battery_charging_power *= 1000
-    sg_battery_discharging_power *= 1000
-
-    # Define a dictionary to hold the variable names and their corresponding values
-    variables = {
-        "f_pvimport": f_pvimport,
-        "f_pvexport": f_pvexport,
-        "f_pvgeneration": f_pvgeneration,
-        "f_pvload": f_pvload,
-        "sg_purchased_power": sg_purchased_power,
-        "sg_total_export_active__power": sg_total_export_active__power,
-        "sg_battery_charging_power": sg_battery_charging_power,
-        "sg_battery_discharging_power": sg_battery_discharging_power,
-    }
-
-    # Loop through each variable and perform the division operation
-    for key, value in variables.items():
-        # Divide the value by the corresponding divisor
-        variables[key] = int(value / 625)
-        # Limit the value to a maximum of 8 LEDs
-        variables[key] = min(variables[key], 8)
-
-    # Extract the updated values from the dictionary
-    led_f_pvimport = variables["f_pvimport"]
-    led_f_pvexport = variables["f_pvexport"]
-    led_f_pvgeneration = variables["f_pvgeneration"]
-    led_f_pvload = variables["f_pvload"]
-    led_sg_purchased_power = variables["sg_purchased_power"]
-    led_sg_total_export_active__power = variables["sg_total_export_active__power"]
-    led_sg_battery_charging_power = variables["sg_battery_charging_power"]
-    led_sg_battery_discharging_power = variables["sg_battery_discharging_power"]
-    
-    # Convert battery level from percentage (0 - 100) to number of LEDs (8)
-    led_sg_battery_level_soc = int(sg_battery_level_soc/12.5)
-
-    # Ensure values do not exceed 8 LEDs
-    led_f_pvimport = min(led_f_pvimport, 8)
-    led_f_pvexport = min(led_f_pvexport, 8)
-    led_f_pvgeneration = min(led_f_pvgeneration, 8)
-    led_f_pvload = min(led_f_pvload, 8)
-    led_sg_purchased_power = min(led_sg_purchased_power, 8)
-    led_sg_total_export_active__power = min(led_sg_total_export_active__power, 8)
-    led_sg_battery_charging_power = min(led_sg_battery_charging_power, 8)
-    led_sg_battery_discharging_power = min(led_sg_battery_discharging_power, 8)
-    led_sg_battery_level_soc = min(led_sg_battery_level_soc, 8)
-
-    # logger.debug("update_senseHatLED params now: " + str(pvimport) + ", " + str(pvexport) + ", " + str(pvload) + ", " + str(pvgeneration))
-
-    # Clear LED Matrix
-    sense.clear()
-
-    # Clear LED Matrix
-    global cli_matrix
-    cli_matrix = [['X' for _ in range(8)] for _ in range(8)]
-
-    # Starting with Fronius PV export and Sungrow Export
-    if led_f_pvexport > 0:
-        for i in range(led_f_pvexport):
-            sense.set_pixel(0, i, lightgreen)
-            cli_matrix[0][i] = 'g'
-    if led_sg_total_export_active__power > 0:
-        for i in range(led_sg_total_export_active__power):
-            sense.set_pixel(1, i, green)
-            cli_matrix[1][i] = 'G'
-
-    # Then Fronius PV import and Sungrow Import
-    if led_f_pvimport > 0:
-        for i in range(led_f_pvimport):
-            sense.set_pixel(2, i, lightred)
-            cli_matrix[2][i] = 'r'
-    if led_sg_purchased_power > 0:
-        for i in range(led_sg_purchased_power):
-            sense.set_pixel(3, i, red)
-            cli_matrix[3][i] = 'R'
-
-    # Then Fronius Self Consumption and Generation
-    if led_f_pvload > 0:
-        for i in range(led_f_pvload):
-            sense.set_pixel(4, i, orange)
-            cli_matrix[4][i] = 'O'
-    if led_f_pvgeneration > 0:
-        for i in range(led_f_pvgeneration):
-            sense.set_pixel(5, i, yellow)
-            cli_matrix[5][i] = 'Y'
-
-    # Then Sungrow Battery Charging and Discharging
-    if led_sg_battery_discharging_power > 0:
-        for i in range(led_sg_battery_discharging_power):
-            sense.set_pixel(6, i, purple)
-            cli_matrix[6][i] = 'P'
-    elif led_sg_battery_charging_power > 0:
-        for i in range(led_sg_battery_charging_power):
-            sense.set_pixel(6, i, lightpurple)
-            cli_matrix[6][i] = 'p'
-
-    # Then Sungrow Battery Level
-    if led_sg_battery_level_soc > 0:
-        for i in range(led_sg_battery_level_soc):
-            sense.set_pixel(7, i, darkblue)
-            cli_matrix[7][i] = 'B'
-
+def update_senseHatLED(state):
+
+    # One vectorized pass: scale to watts, 625 W per LED, capped at 8
+    leds = np.minimum((state * _led_scale).astype(np.int64) // 625, 8).tolist()
+
+    # logger.debug("update_senseHatLED state now: " + str(state))
+
+    # Skip the redraw entirely if nothing visible has changed
+    global _last_led_state
+    led_state = tuple(leds)
+    if led_state == _last_led_state:
+        return
+    _last_led_state = led_state
+
+    # Column 6: Sungrow battery discharging takes precedence over charging
+    discharging = leds[IDX_SG_BATTERY_DISCHARGING_POWER] > 0
+    if discharging:
+        battery_count = leds[IDX_SG_BATTERY_DISCHARGING_POWER]
+    else:
+        battery_count = leds[IDX_SG_BATTERY_CHARGING_POWER]
+
+    # Lay the LED counts out in column order for the frame kernel
+    _counts[0] = leds[IDX_F_PVEXPORT]
+    _counts[1] = leds[IDX_SG_TOTAL_EXPORT_ACTIVE_POWER]
+    _counts[2] = leds[IDX_F_PVIMPORT]
+    _counts[3] = leds[IDX_SG_PURCHASED_POWER]
+    _counts[4] = leds[IDX_F_PVLOAD]
+    _counts[5] = leds[IDX_F_PVGENERATION]
+    _counts[6] = battery_count
+    _counts[7] = leds[IDX_SG_BATTERY_LEVEL_SOC]
+
+    # Build the new frame off-screen in the preallocated buffer
+    build_frame(_counts, _col_rgb_discharging if discharging else _col_rgb_charging, _out)
+
+    # Queue the frame for the LED worker, and only if it differs
+    global _framebuffer
+    framebuffer = _out.tolist()
+    if framebuffer != _framebuffer:
+        _queue_frame(framebuffer)
+        _framebuffer = framebuffer
 
     # Optionally, Sungrow Battery Charging, animated
-    # animate_battery(led_sg_battery_charging_power, led_sg_battery_discharging_power, led_sg_battery_level_soc)
-
-    # Print the LED matrix grid - remark this out when no longer testing
-    print_cli_matrix(cli_matrix)
+    # animate_battery(leds[IDX_SG_BATTERY_CHARGING_POWER], leds[IDX_SG_BATTERY_DISCHARGING_POWER], leds[IDX_SG_BATTERY_LEVEL_SOC])
+
+    # Print the LED matrix grid when debugging is enabled
+    if DEBUG_CLI:
+        cli_matrix.fill('X')
+        chars = _COL_CHARS_DISCHARGING if discharging else _COL_CHARS_CHARGING
+        for col in range(8):
+            count = int(_counts[col])
+            if count > 0:
+                cli_matrix[col, :count] = chars[col]
+        print_cli_matrix(cli_matrix)
 
 def main():
     # Initialize MQTT client
-    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)    
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
     client.on_connect=on_connect # attach function to callback
-    client.loop_start()
-    client.connect(broker_address, broker_port, 60) 
     client.on_message = on_message
-    
+    client.connect(broker_address, broker_port, 60)
+
+    # Start the render worker in a separate thread
+    render_thread = threading.Thread(target=render_worker)
+    render_thread.daemon = True  # Terminates when the main thread exits
+    render_thread.start()
+
+    # Start the LED writer in a separate thread
+    led_thread = threading.Thread(target=led_worker)
+    led_thread.daemon = True  # Terminates when the main thread exits
+    led_thread.start()
+
     # Start the animation loop in a separate thread
     # animation_thread = threading.Thread(target=animate_battery)
     # animation_thread.daemon = True  # Set the thread as a daemon so it terminates when the main thread exits
@@ -306,9 +395,9 @@ def main():
     # Trigger the watchdog
     notifier.notify("WATCHDOG=1")
 
-    # Main loop to keep the program running
-    while True:
-        time.sleep(0.1)
+    # Run the MQTT network loop in the main thread; no extra network
+    # thread or idle wakeups needed
+    client.loop_forever()
 
 # Check if the script is executed as the main program
 if __name__ == "__main__":